@@ -1,9 +1,16 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import pymongo
 import os
-import yfinance as yf
+import json
+import functools
+import threading
+import time
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+import numpy as np
 from dotenv import load_dotenv
+from curl_cffi import requests as curl_requests
 
 load_dotenv()
 
@@ -12,60 +19,243 @@ CORS(app) # Enable CORS for all routes
 
 MONGO_URI = os.getenv("MONGO_URI")
 
+# Number of most recent trades returned by /api/trades
+TRADES_LIMIT = 50
+
+# Live price cache: symbol -> (fetched_at, price)
+PRICE_TTL_SECONDS = 15
+_price_cache = {}
+_price_lock = threading.Lock()
+
+# Background refresher keeps _price_cache warm for held symbols during market hours
+REFRESH_INTERVAL_SECONDS = 10
+HOLDINGS_RELOAD_SECONDS = 60
+_refresher_started = False
+_refresher_lock = threading.Lock()
+
+# NSE regular session (IST)
+IST = ZoneInfo("Asia/Kolkata")
+MARKET_OPEN = (9, 15)
+MARKET_CLOSE = (15, 30)
+# NSE publishes the official close (VWAP of the last 30 minutes) a few minutes after
+# 15:30 and Yahoo's Close follows; snapshots only count as final after this buffer
+CLOSE_SETTLE = timedelta(minutes=30)
+
+# Shared HTTP session for yfinance (keep-alive across requests)
+yf_session = curl_requests.Session(impersonate="chrome")
+
+@functools.lru_cache(maxsize=1)
+def _client():
+    # Created once per process; pymongo pools connections internally
+    return pymongo.MongoClient(MONGO_URI, maxPoolSize=50, serverSelectionTimeoutMS=3000)
+
 def get_db():
     if not MONGO_URI:
         return None
     try:
-        client = pymongo.MongoClient(MONGO_URI)
-        return client["ai_hedge_fund"]
+        return _client()["ai_hedge_fund"]
     except Exception as e:
         print(f"DB Error: {e}")
         return None
 
+def _fetch_prices(symbols, chunk_size=10):
+    """
+    Fetches the last traded price for many symbols using batched yf.download calls
+    (one HTTP round trip per chunk instead of one per symbol).
+    Symbols that fail are simply missing from the returned dict.
+    """
+    import yfinance as yf # Lazy: keeps API cold start light
+    
+    prices = {}
+    for i in range(0, len(symbols), chunk_size):
+        chunk = symbols[i:i + chunk_size]
+        try:
+            df = yf.download(" ".join(chunk), period="1d", interval="1d",
+                             group_by="ticker", threads=True, progress=False,
+                             session=yf_session)
+        except Exception as e:
+            print(f"Price download failed for {chunk}: {e}")
+            continue
+        for sym in chunk:
+            try:
+                close = df[sym]["Close"].dropna()
+                if not close.empty:
+                    prices[sym] = float(close.iloc[-1])
+            except KeyError:
+                continue
+    return prices
+
+def _market_open(now=None):
+    # Open from 09:15:00 up to (not including) 15:30:00
+    now = now or datetime.now(IST)
+    return now.weekday() < 5 and MARKET_OPEN <= (now.hour, now.minute) < MARKET_CLOSE
+
+def _session_close(day):
+    return day.replace(hour=MARKET_CLOSE[0], minute=MARKET_CLOSE[1], second=0, microsecond=0)
+
+def _close_settled(now=None):
+    """
+    True when prices cannot move any more: outside the session and past the
+    settle buffer after the close (weekends included).
+    """
+    now = now or datetime.now(IST)
+    if now.weekday() >= 5:
+        return True
+    return not (_market_open(now) or _session_close(now) <= now < _session_close(now) + CLOSE_SETTLE)
+
+def _last_settled_close(now):
+    settled = _session_close(now) + CLOSE_SETTLE
+    if now < settled:
+        settled -= timedelta(days=1)
+    while settled.weekday() >= 5: # Skip weekends
+        settled -= timedelta(days=1)
+    return settled
+
+def _load_snapshots(db, symbols):
+    """
+    Returns {symbol: price} for snapshots taken after the last session's close
+    had settled, i.e. final prices that cannot have changed since (single query).
+    """
+    since = _last_settled_close(datetime.now(IST)).timestamp()
+    docs = db["price_snapshots"].find(
+        {"_id": {"$in": symbols}, "updated_at": {"$gte": since}},
+        {"price": 1}
+    )
+    return {d["_id"]: d["price"] for d in docs}
+
+def _save_snapshots(db, prices):
+    if not prices:
+        return
+    now = time.time()
+    ops = [
+        pymongo.UpdateOne({"_id": sym}, {"$set": {"price": price, "updated_at": now}}, upsert=True)
+        for sym, price in prices.items()
+    ]
+    try:
+        db["price_snapshots"].bulk_write(ops, ordered=False)
+    except Exception as e:
+        print(f"Snapshot write failed: {e}")
+
+def get_prices(symbols, ttl=PRICE_TTL_SECONDS, db=None):
+    """
+    Returns {symbol: price}, serving symbols fetched within the last `ttl` seconds
+    from memory and batch-fetching only the stale ones.
+    Freshly fetched prices are persisted to `price_snapshots` when `db` is given.
+    """
+    now = time.time()
+    prices = {}
+    stale = []
+    with _price_lock:
+        for sym in symbols:
+            ts, price = _price_cache.get(sym, (0, None))
+            if now - ts < ttl:
+                prices[sym] = price
+            else:
+                stale.append(sym)
+
+    if stale:
+        fresh = _fetch_prices(stale)
+        _store_prices(fresh, db)
+        prices.update(fresh)
+    return prices
+
+def _store_prices(fresh, db=None):
+    fetched_at = time.time()
+    with _price_lock:
+        for sym, price in fresh.items():
+            _price_cache[sym] = (fetched_at, price)
+    if db is not None:
+        _save_snapshots(db, fresh)
+
+def _refresh_loop():
+    """
+    Polls live prices for all held symbols every few seconds while the market is open,
+    so /api/stats is normally served from memory without any network I/O.
+    """
+    symbols = []
+    symbols_loaded_at = 0
+    while True:
+        try:
+            if _market_open():
+                db = get_db()
+                if db is not None:
+                    if time.time() - symbols_loaded_at > HOLDINGS_RELOAD_SECONDS:
+                        symbols = db["users"].distinct("portfolio.symbol")
+                        symbols_loaded_at = time.time()
+                    if symbols:
+                        _store_prices(_fetch_prices(symbols), db)
+        except Exception as e:
+            print(f"Price refresher error: {e}")
+        time.sleep(REFRESH_INTERVAL_SECONDS)
+
+def _ensure_price_refresher():
+    global _refresher_started
+    if _refresher_started:
+        return
+    with _refresher_lock:
+        if not _refresher_started:
+            threading.Thread(target=_refresh_loop, name="price-refresher", daemon=True).start()
+            _refresher_started = True
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     db = get_db()
     if db is None:
         return jsonify({"error": "DB not connected"}), 500
+    _ensure_price_refresher()
     
-    user = db["users"].find_one({"_id": "user_001"})
+    user = db["users"].find_one(
+        {"_id": "user_001"},
+        {"portfolio": 1, "balance": 1, "capital": 1, "settings": 1}
+    )
     if not user:
         return jsonify({"error": "User not found"}), 404
         
-    # Calculate Portfolio Value & Enrich Holdings with Live Data
-    portfolio_value = 0
     holdings = user.get("portfolio", [])
-    enriched_holdings = []
+    if not holdings:
+        # New / fully sold accounts: nothing to price
+        return jsonify({
+            "balance": user.get("balance"),
+            "capital": user.get("capital"),
+            "portfolio_value": 0,
+            "total_equity": user.get("balance", 0),
+            "settings": user.get("settings", {}),
+            "holdings_count": 0,
+            "portfolio": []
+        })
 
-    for h in holdings:
-        qty = h.get("qty", 0)
-        avg_price = h.get("avg_price", 0)
-        
-        try:
-            # Fetch real-time price
-            ticker = yf.Ticker(h["symbol"])
-            current_price = ticker.fast_info.last_price
-            
-            # Calculate Value & PnL
-            market_value = qty * current_price
-            portfolio_value += market_value
-            
-            # Add live data to holding object for UI
-            h_copy = h.copy()
-            h_copy["current_price"] = current_price
-            h_copy["market_value"] = market_value
-            h_copy["pnl"] = market_value - (qty * avg_price)
-            h_copy["pnl_percent"] = ((current_price - avg_price) / avg_price) * 100 if avg_price > 0 else 0
-            enriched_holdings.append(h_copy)
-            
-        except Exception as e:
-             # Fallback to cost basis
-             # print(f"Price fetch failed for {h['symbol']}: {e}")
-             val = qty * avg_price
-             portfolio_value += val
-             h_copy = h.copy()
-             h_copy["current_price"] = avg_price
-             enriched_holdings.append(h_copy)
+    # Fetch real-time prices (cached for a few seconds, batched on miss).
+    # Once the close has settled prices cannot move, so serve the stored snapshot.
+    symbols = list(dict.fromkeys(h["symbol"] for h in holdings))
+    if not _close_settled():
+        prices = get_prices(symbols, db=db)
+    else:
+        prices = _load_snapshots(db, symbols)
+        missing = [sym for sym in symbols if sym not in prices]
+        if missing:
+            prices.update(get_prices(missing, db=db))
+
+    # Calculate Portfolio Value & PnL for all holdings at once
+    qty = np.array([h.get("qty", 0) for h in holdings], dtype=np.float64)
+    avg = np.array([h.get("avg_price", 0) for h in holdings], dtype=np.float64)
+    px = np.array([prices.get(h["symbol"], np.nan) for h in holdings], dtype=np.float64)
+
+    # Fallback to cost basis where no live price is available
+    missing = np.isnan(px)
+    if missing.any():
+        print(f"Price fallback (cost basis) for: {[h['symbol'] for h, m in zip(holdings, missing) if m]}")
+    px = np.where(missing, avg, px)
+
+    mv = qty * px
+    pnl = mv - qty * avg
+    pnlp = np.divide((px - avg) * 100, avg, out=np.zeros_like(avg), where=avg > 0)
+    portfolio_value = float(mv.sum())
+
+    # Enrich Holdings with Live Data for UI
+    enriched_holdings = [
+        {**h, "current_price": p, "market_value": v, "pnl": g, "pnl_percent": gp}
+        for h, p, v, g, gp in zip(holdings, px.tolist(), mv.tolist(), pnl.tolist(), pnlp.tolist())
+    ]
     
     total_equity = user.get("balance", 0) + portfolio_value
     
@@ -85,11 +275,28 @@ def get_trades():
     if db is None:
         return jsonify({"error": "DB not connected"}), 500
         
-    trades = list(db["trade_logs"].find().sort("timestamp", -1).limit(50))
-    for t in trades:
-        t["_id"] = str(t["_id"]) # Convert ObjectId to string
+    # One network batch from Mongo, serialized row by row (ObjectId -> str via default)
+    cursor = db["trade_logs"].find().sort("timestamp", -1).limit(TRADES_LIMIT).batch_size(TRADES_LIMIT)
+    # The cursor is lazy: fetch the first row before the 200 goes out so DB errors still return a 500
+    try:
+        first = next(cursor, None)
+    except Exception as e:
+        cursor.close()
+        print(f"Error fetching trades: {e}")
+        return jsonify({"error": "Failed to fetch trades"}), 500
+
+    def generate():
+        try:
+            yield "["
+            if first is not None:
+                yield json.dumps(first, default=str)
+                for t in cursor:
+                    yield "," + json.dumps(t, default=str)
+            yield "]"
+        finally:
+            cursor.close()
         
-    return jsonify(trades)
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 @app.route('/api/toggle_status', methods=['POST'])
 def toggle_status():
@@ -97,16 +304,21 @@ def toggle_status():
     if db is None:
         return jsonify({"error": "DB not connected"}), 500
     
-    user = db["users"].find_one({"_id": "user_001"})
-    current_status = user.get("settings", {}).get("status", "ACTIVE")
-    new_status = "PAUSED" if current_status == "ACTIVE" else "ACTIVE"
-    
-    db["users"].update_one(
+    # Flip the status server-side in one atomic round trip (pipeline update)
+    user = db["users"].find_one_and_update(
         {"_id": "user_001"},
-        {"$set": {"settings.status": new_status}}
+        [{"$set": {"settings.status": {"$cond": [
+            {"$eq": [{"$ifNull": ["$settings.status", "ACTIVE"]}, "ACTIVE"]},
+            "PAUSED",
+            "ACTIVE"
+        ]}}}],
+        projection={"settings.status": 1},
+        return_document=pymongo.ReturnDocument.AFTER
     )
+    if not user:
+        return jsonify({"error": "User not found"}), 404
     
-    return jsonify({"status": new_status})
+    return jsonify({"status": user["settings"]["status"]})
 @app.route('/api/save_settings', methods=['POST'])
 def save_settings():
     db = get_db()
@@ -124,20 +336,12 @@ def save_settings():
         db["trade_logs"].delete_many({}) # Clear history
     
     if "expected_return" in data or "period" in data:
-        settings_update = {}
-        if "expected_return" in data: settings_update["settings.expected_return"] = data["expected_return"]
-        if "period" in data: settings_update["settings.investment_period"] = data["period"]
-        if "risk" in data: settings_update["settings.risk_profile"] = data["risk"]
-        
-        # Reset Start Date on new strategy
-        from datetime import datetime
-        settings_update["settings.start_date"] = datetime.now().isoformat()
-        
-        db["users"].update_one({"_id": "user_001"}, {"$set": settings_update})
+        if "expected_return" in data: update_data["settings.expected_return"] = data["expected_return"]
+        if "period" in data: update_data["settings.investment_period"] = data["period"]
+        if "risk" in data: update_data["settings.risk_profile"] = data["risk"]
 
     if update_data:
-        # If Balance reset, also reset start date
-        from datetime import datetime
+        # New balance or new strategy resets the start date (single write)
         update_data["settings.start_date"] = datetime.now().isoformat()
         db["users"].update_one({"_id": "user_001"}, {"$set": update_data})
         
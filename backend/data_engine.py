@@ -1,8 +1,22 @@
 import yfinance as yf
-import pandas as pd
 import json
 import requests
 import io
+import csv
+import time
+import functools
+from pathlib import Path
+from curl_cffi import requests as curl_requests
+
+# Shared HTTP session for yfinance so TLS connections are reused across calls.
+# Chrome-impersonating curl_cffi (yfinance's own default transport) is less prone to
+# Yahoo's rate limiting than a plain requests.Session; caching sessions such as
+# requests_cache.CachedSession are rejected by yfinance.
+yf_session = curl_requests.Session(impersonate="chrome")
+
+# Local cache for the NSE equity list (it changes at most daily)
+NSE_CACHE_PATH = Path.home() / ".cache" / "aihf" / "nse_equity.json"
+NSE_CACHE_TTL_SECONDS = 24 * 60 * 60
 
 # Fallback List (Nifty 100)
 HARDCODED_NIFTY_100 = [
@@ -21,11 +35,10 @@ HARDCODED_NIFTY_100 = [
     "TATAELXSI.NS", "ALKEM.NS", "AUBANK.NS", "AUROPHARMA.NS", "BALKRISIND.NS", "BANDHANBNK.NS", "BHARATFORG.NS"
 ]
 
-def get_all_nse_tickers():
+def _fetch_nse_tickers():
     """
-    Fetches the list of all active equity symbols from NSE website.
-    Returns a list of symbols with '.NS' appended.
-    Falls back to HARDCODED_NIFTY_100 if download fails.
+    Downloads the list of all active equity symbols from NSE website.
+    Returns a list of symbols with '.NS' appended, or None if download fails.
     """
     try:
         # NSE Equity List URL
@@ -38,36 +51,74 @@ def get_all_nse_tickers():
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
         
-        # Parse CSV
-        df = pd.read_csv(io.StringIO(response.content.decode('utf-8')))
+        # Parse CSV (header names may carry stray spaces)
+        reader = csv.reader(io.StringIO(response.content.decode('utf-8')))
+        header = [col.strip() for col in next(reader, [])]
         
         # Extract SYMBOL column and append .NS
-        if 'SYMBOL' in df.columns:
-            tickers = [f"{sym}.NS" for sym in df['SYMBOL'].tolist()]
+        if 'SYMBOL' in header:
+            idx = header.index('SYMBOL')
+            # Strip stray whitespace seen in the NSE file and skip blank rows
+            symbols = (row[idx].strip() for row in reader if len(row) > idx)
+            tickers = [sym + ".NS" for sym in symbols if sym]
             print(f"Successfully fetched {len(tickers)} tickers from NSE.")
             return tickers
         else:
             print("CSV format changed, column 'SYMBOL' not found.")
-            return HARDCODED_NIFTY_100
+            return None
             
     except Exception as e:
-        print(f"Failed to fetch from NSE: {e}. Using fallback list.")
+        print(f"Failed to fetch from NSE: {e}.")
+        return None
+
+@functools.lru_cache(maxsize=1)
+def get_all_nse_tickers():
+    """
+    Returns the list of all active NSE equity symbols with '.NS' appended.
+    Served from a local file cache when it is less than a day old, otherwise
+    downloaded from NSE and cached. If the download fails, an expired cache is used
+    before falling back to HARDCODED_NIFTY_100.
+    Computed lazily on first call (not at import time).
+    """
+    try:
+        if NSE_CACHE_PATH.exists() and time.time() - NSE_CACHE_PATH.stat().st_mtime < NSE_CACHE_TTL_SECONDS:
+            return json.loads(NSE_CACHE_PATH.read_text())
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable ticker cache: {e}")
+
+    tickers = _fetch_nse_tickers()
+    if not tickers:
+        # A day-old full list beats shrinking the universe to 100 symbols
+        try:
+            stale = json.loads(NSE_CACHE_PATH.read_text())
+            if stale:
+                print("Using expired ticker cache.")
+                return stale
+        except (OSError, ValueError):
+            pass
+        print("Using fallback list.")
         return HARDCODED_NIFTY_100
 
-# Expose the function result (or the function itself)
-ALL_MARKET_TICKERS = get_all_nse_tickers()
+    try:
+        NSE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        NSE_CACHE_PATH.write_text(json.dumps(tickers))
+    except OSError as e:
+        print(f"Could not write ticker cache: {e}")
+    return tickers
 
-def fetch_stock_data(ticker_symbol):
+def fetch_stock_data(ticker_symbol, history=None):
     """
     Fetches 1-month and 1-week OHLC data, fundamental info, and news for a specific stock.
+    `history` is an already downloaded 1-month daily frame; when given, only info/news are fetched
+    and the current price is its last close.
     Return None if data is incomplete or empty.
     """
     try:
-        ticker = yf.Ticker(ticker_symbol)
+        ticker = yf.Ticker(ticker_symbol, session=yf_session)
         
         # 1. Price History
         # We need enough data for TA. 1mo is good for daily, 5d for short term.
-        hist = ticker.history(period="1mo")
+        hist = history if history is not None else ticker.history(period="1mo")
         
         if hist.empty:
             return None
@@ -76,7 +127,7 @@ def fetch_stock_data(ticker_symbol):
         info = ticker.info
         fundamentals = {
             "symbol": ticker_symbol,
-            "current_price": info.get("currentPrice") or info.get("regularMarketPrice"),
+            "current_price": float(hist["Close"].iloc[-1]) if history is not None else (info.get("currentPrice") or info.get("regularMarketPrice")),
             "market_cap": info.get("marketCap"),
             "pe_ratio": info.get("trailingPE"),
             "debt_to_equity": info.get("debtToEquity"),
@@ -1,12 +1,13 @@
 import os
-import yfinance as yf
-import pandas as pd
-import pandas_ta as ta
 import pymongo
 from google import genai
 import json
-from datetime import datetime
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from curl_cffi import requests as curl_requests
 
 # Load environment variables
 load_dotenv()
@@ -14,10 +15,14 @@ load_dotenv()
 # Configuration
 MONGO_URI = os.getenv("MONGO_URI")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "5")) # Requests per minute allowed by the API tier
 
 # Initialize Clients
 client = genai.Client(api_key=GEMINI_API_KEY)
 
+# Shared yfinance session for this script (same setup as data_engine.yf_session)
+yf_session = curl_requests.Session(impersonate="chrome")
+
 # DB Connection (Global)
 mongo_client = None
 if MONGO_URI:
@@ -27,6 +32,34 @@ if MONGO_URI:
     except Exception as e:
         print(f"MongoDB Connection Failed: {e}")
 
+class RateLimiter:
+    """
+    Thread-safe token bucket: allows `rate` calls per `per` seconds, blocking callers when empty.
+    """
+    def __init__(self, rate, per=60.0):
+        self.capacity = max(1, rate)
+        self.tokens = float(self.capacity)
+        self.fill_rate = self.capacity / per
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.fill_rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.fill_rate
+            time.sleep(wait)
+
+gemini_limiter = RateLimiter(GEMINI_RPM)
+
+# Fundamentals barely move intraday: cached per symbol in Mongo (`fundamentals_cache`)
+FUNDAMENTALS_TTL = timedelta(hours=24)
+
 def fetch_portfolio(user_id="user_001"):
     """
     Fetches the user's current holdings to provide context to the AI.
@@ -49,53 +82,111 @@ def fetch_portfolio(user_id="user_001"):
         print(f"Error fetching portfolio: {e}")
         return {}
 
-def fetch_stock_data(ticker_symbol):
+def _get_fundamentals(ticker_symbol, ticker):
     """
-    Fetches 1-month and 1-week OHLC data, fundamental info, and news for a specific stock.
+    Returns fundamental info for a yfinance Ticker, only calling the slow
+    `ticker.info` endpoint when the cached copy is older than a day.
     """
-    try:
-        ticker = yf.Ticker(ticker_symbol)
-        
-        # 1. Price History (1 Month for daily trend, 1 Week for short term)
-        hist_1mo = ticker.history(period="1mo")
-        hist_1wk = ticker.history(period="5d") # 1 week (5 trading days)
-        
-        # 2. Fundamentals
-        info = ticker.info
-        fundamentals = {
-            "symbol": ticker_symbol,
-            "current_price": info.get("currentPrice"),
-            "market_cap": info.get("marketCap"),
-            "pe_ratio": info.get("trailingPE"),
-            "debt_to_equity": info.get("debtToEquity"),
-            "profit_margins": info.get("profitMargins"),
-            "sector": info.get("sector"),
-            "industry": info.get("industry"),
-            "long_business_summary": info.get("longBusinessSummary") # Company Background
-        }
-        
-        # 3. News (Specific to the company)
-        news_list = ticker.news
-        recent_news = []
-        if news_list:
-            for n in news_list[:5]: # Top 5 news items
-                recent_news.append({
-                    "title": n.get("title"),
-                    "publisher": n.get("publisher"),
-                    "link": n.get("link"),
-                    "relatedTickers": n.get("relatedTickers")
-                })
-        
-        return {
-            "history_1mo": hist_1mo.to_csv(),
-            "history_1wk": hist_1wk.to_csv(),
-            "fundamentals": fundamentals,
-            "news": recent_news
-        }
+    cache = mongo_client["ai_hedge_fund"]["fundamentals_cache"] if mongo_client else None
+    now = datetime.now(timezone.utc)
+    if cache is not None:
+        try:
+            cached = cache.find_one({"_id": ticker_symbol, "ts": {"$gt": now - FUNDAMENTALS_TTL}})
+            if cached:
+                return cached["fundamentals"]
+        except Exception as e:
+            print(f"Fundamentals cache read failed for {ticker_symbol}: {e}")
 
-    except Exception as e:
-        print(f"Error fetching data for {ticker_symbol}: {e}")
-        return None
+    info = ticker.info
+    fundamentals = {
+        "symbol": ticker_symbol,
+        "market_cap": info.get("marketCap"),
+        "pe_ratio": info.get("trailingPE"),
+        "debt_to_equity": info.get("debtToEquity"),
+        "profit_margins": info.get("profitMargins"),
+        "sector": info.get("sector"),
+        "industry": info.get("industry"),
+        "long_business_summary": info.get("longBusinessSummary") # Company Background
+    }
+    if cache is not None:
+        try:
+            cache.update_one({"_id": ticker_symbol}, {"$set": {"fundamentals": fundamentals, "ts": now}}, upsert=True)
+        except Exception as e:
+            print(f"Fundamentals cache write failed for {ticker_symbol}: {e}")
+    return fundamentals
+
+def _fetch_details(ticker_symbol, ticker):
+    """
+    Fetches fundamental info (cached) and news for a single yfinance Ticker.
+    """
+    fundamentals = _get_fundamentals(ticker_symbol, ticker)
+    
+    # News (Specific to the company)
+    news_list = ticker.news
+    recent_news = []
+    if news_list:
+        for n in news_list[:5]: # Top 5 news items
+            recent_news.append({
+                "title": n.get("title"),
+                "publisher": n.get("publisher"),
+                "link": n.get("link"),
+                "relatedTickers": n.get("relatedTickers")
+            })
+    return fundamentals, recent_news
+
+def fetch_stock_data_batch(ticker_symbols, batch_size=10):
+    """
+    Fetches 1-month daily closes/volumes, fundamental info, and news for many stocks.
+    Price history is downloaded with one yf.download call per batch of symbols;
+    info and news are fetched concurrently.
+    Returns {symbol: data}, with None for symbols that could not be fetched.
+    """
+    import yfinance as yf # Lazy: only needed once we actually fetch
+    
+    results = {}
+    for i in range(0, len(ticker_symbols), batch_size):
+        batch = ticker_symbols[i:i + batch_size]
+        try:
+            # 1. Price History (1 Month of daily bars)
+            hist = yf.download(" ".join(batch), period="1mo", group_by="ticker",
+                               threads=True, progress=False, session=yf_session)
+            tickers = yf.Tickers(" ".join(batch), session=yf_session)
+        except Exception as e:
+            print(f"Error fetching data for {batch}: {e}")
+            results.update({sym: None for sym in batch})
+            continue
+
+        def details(sym):
+            try:
+                return _fetch_details(sym, tickers.tickers[sym])
+            except Exception as e:
+                print(f"Error fetching data for {sym}: {e}")
+                return None
+
+        # 2. Fundamentals & News
+        with ThreadPoolExecutor(max_workers=8) as ex:
+            details_map = dict(zip(batch, ex.map(details, batch)))
+
+        for sym in batch:
+            try:
+                hist_1mo = hist[sym].dropna(how="all")
+            except KeyError:
+                hist_1mo = None
+            if hist_1mo is None or hist_1mo.empty or details_map[sym] is None:
+                results[sym] = None
+                continue
+
+            fundamentals, recent_news = details_map[sym]
+            # Compact arrays (oldest -> newest) keep the LLM prompt small
+            closes = [round(float(x), 2) for x in hist_1mo["Close"].dropna().tolist()]
+            results[sym] = {
+                "closes_1mo": closes,
+                "volumes_1mo": [int(v) for v in hist_1mo["Volume"].fillna(0).tolist()],
+                # Price comes from the fresh history, not the (cached) info
+                "fundamentals": {**fundamentals, "current_price": closes[-1] if closes else None},
+                "news": recent_news
+            }
+    return results
 
 
 def analyze_with_gemini(stock_data, holding=None):
@@ -132,8 +223,9 @@ def analyze_with_gemini(stock_data, holding=None):
        - P/E Ratio: {stock_data['fundamentals']['pe_ratio']}
        - Debt-to-Equity: {stock_data['fundamentals']['debt_to_equity']}
        - Profit Margins: {stock_data['fundamentals']['profit_margins']}
-    3. **Price History (1 Month CSV)**:
-    {stock_data['history_1mo']}
+    3. **Price History (1 Month, daily, oldest to newest)**:
+       - Closes: {json.dumps(stock_data['closes_1mo'])}
+       - Volumes: {json.dumps(stock_data['volumes_1mo'])}
     
     4. **Recent News**:
     {json.dumps(stock_data['news'], indent=2)}
@@ -163,6 +255,7 @@ def analyze_with_gemini(stock_data, holding=None):
 
     # 3. CALL API WITH RETRY LOGIC
     for attempt in range(3):
+        gemini_limiter.acquire()
         try:
             response = client.models.generate_content(
                 model=model_name,
@@ -193,28 +286,27 @@ def save_to_mongodb(strategy_data):
     """
     Saves the daily strategy to MongoDB.
     """
-    if not MONGO_URI:
+    if not mongo_client:
         print("MONGO_URI not set. Skipping DB write.")
         print(json.dumps(strategy_data, indent=2))
         return
 
     try:
-        client = pymongo.MongoClient(MONGO_URI)
-        db = client["ai_hedge_fund"]
+        db = mongo_client["ai_hedge_fund"]
         collection = db["daily_strategy"]
         
         # Check if strategy already exists for today
         query = {"date": strategy_data["date"]}
-        update = {"$set": strategy_data}
+        update = {
+            "$set": {k: v for k, v in strategy_data.items() if k != "date"},
+            "$setOnInsert": {"date": strategy_data["date"]} # Immutable, only written on insert
+        }
         
         result = collection.update_one(query, update, upsert=True)
         print(f"Strategy saved to MongoDB using URI: {MONGO_URI[:10]}... (Upserted: {result.upserted_id is not None})")
-        client.close()
     except Exception as e:
         print(f"MongoDB Error: {e}")
 
-import time
-
 if __name__ == "__main__":
     print("--- Gemini 2.0 Pro: Daily Review Strategy ---")
     
@@ -228,24 +320,23 @@ if __name__ == "__main__":
     
     watchlist = []
     
+    # 1. Fetch market data for all tickers in batches
+    print(f"\nFetching data for {len(tickers)} tickers...")
+    data_map = fetch_stock_data_batch(tickers)
+    
+    # 2. ASK GEMINI for a few tickers at a time (rate limited by gemini_limiter)
+    ready = [t for t in tickers if data_map[t]]
+    print(f"Asking Gemini about {len(ready)} tickers...")
+    with ThreadPoolExecutor(max_workers=3) as ex:
+        responses = dict(zip(ready, ex.map(lambda t: analyze_with_gemini(data_map[t], portfolio.get(t)), ready)))
+    
     for ticker in tickers:
         print(f"\nProcessing {ticker}...")
-        data = fetch_stock_data(ticker)
+        data = data_map[ticker]
         
         if data:
-            # 1. Quick Filter: Only analyze if data is valid
             print(f"  > Data fetched. Fundamentals: P/E={data['fundamentals'].get('pe_ratio')}")
-            
-            # 2. ASK GEMINI
-            # Check if we hold this stock
-            holding = portfolio.get(ticker)
-            
-            print("  > Asking Gemini...")
-            analysis_json_str = analyze_with_gemini(data, holding)
-            
-            # Rate Limit Delay (Aggressive for free tier)
-            print("  > Waiting 30s to respect API rate limits...")
-            time.sleep(30)
+            analysis_json_str = responses.get(ticker)
             
             if analysis_json_str:
                 try:
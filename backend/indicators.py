@@ -0,0 +1,145 @@
+from collections import deque
+import numpy as np
+
+# Incremental (streaming) technical indicators.
+# Each symbol/timeframe keeps a small state so a new bar updates RSI (Wilder),
+# SMA and the average volume in O(1) instead of recomputing rolling windows.
+
+RSI_PERIOD = 14
+SMA_PERIOD = 50
+VOL_PERIOD = 20
+
+def state_id(symbol, timeframe):
+    return f"{symbol}:{timeframe}"
+
+def _rsi(avg_gain, avg_loss):
+    if avg_loss == 0:
+        return 100.0 if avg_gain > 0 else 50.0
+    return 100 - 100 / (1 + avg_gain / avg_loss)
+
+def _wilder(avg, value):
+    return (avg * (RSI_PERIOD - 1) + value) / RSI_PERIOD
+
+def _window_mean(total, window, period, value=None):
+    # Mean of the last `period` values, optionally with `value` appended (window not modified)
+    n = len(window)
+    if value is not None:
+        if n == period:
+            total -= window[0]
+        else:
+            n += 1
+        total += value
+    return total / n if n == period else float("nan")
+
+def seed_state(symbol, closes, volumes, last_ts):
+    """
+    Builds indicator state from a history of closed bars (oldest -> newest).
+    Returns None if there are not enough bars to seed RSI.
+    """
+    closes = np.asarray(closes, dtype=np.float64)
+    volumes = np.asarray(volumes, dtype=np.float64)
+    if len(closes) < RSI_PERIOD + 1:
+        return None
+
+    deltas = np.diff(closes)
+    gains = np.clip(deltas, 0, None)
+    losses = np.clip(-deltas, 0, None)
+    # Wilder smoothing unrolled: after m more bars the seed average decays by
+    # (1 - 1/N)^m and each bar k contributes (1/N) * (1 - 1/N)^(m - k)
+    m = len(gains) - RSI_PERIOD
+    decay = 1 - 1 / RSI_PERIOD
+    weights = decay ** np.arange(m - 1, -1, -1) / RSI_PERIOD
+    avg_gain = gains[:RSI_PERIOD].mean() * decay ** m + weights @ gains[RSI_PERIOD:]
+    avg_loss = losses[:RSI_PERIOD].mean() * decay ** m + weights @ losses[RSI_PERIOD:]
+
+    sma_window = deque(closes[-SMA_PERIOD:].tolist(), maxlen=SMA_PERIOD)
+    vol_window = deque(volumes[-VOL_PERIOD:].tolist(), maxlen=VOL_PERIOD)
+    return {
+        "symbol": symbol,
+        "last_close": float(closes[-1]),
+        "avg_gain": float(avg_gain),
+        "avg_loss": float(avg_loss),
+        "sma_window": sma_window,
+        "sma_sum": sum(sma_window),
+        "vol_window": vol_window,
+        "vol_sum": sum(vol_window),
+        "last_ts": float(last_ts)
+    }
+
+def matches_history(state, timestamps, closes, rel_tol=1e-4):
+    """
+    Checks that the bar at state["last_ts"] in fresh history still closes at state["last_close"].
+    Adjusted prices are rescaled after splits/dividends; a mismatch (or a missing bar)
+    means the saved state is on a different price scale and must be re-seeded.
+    """
+    for ts, close in zip(timestamps, closes):
+        if ts == state["last_ts"]:
+            return abs(close - state["last_close"]) <= rel_tol * abs(state["last_close"])
+    return False
+
+def update_state(state, close, volume, ts):
+    """
+    Folds one new closed bar into `state` in O(1).
+    """
+    change = close - state["last_close"]
+    state["avg_gain"] = _wilder(state["avg_gain"], max(change, 0.0))
+    state["avg_loss"] = _wilder(state["avg_loss"], max(-change, 0.0))
+    state["last_close"] = float(close)
+
+    for key, value in (("sma", close), ("vol", volume)):
+        window = state[f"{key}_window"]
+        if len(window) == window.maxlen:
+            state[f"{key}_sum"] -= window[0]
+        window.append(float(value)) # deque drops the oldest value itself
+        state[f"{key}_sum"] += float(value)
+
+    state["last_ts"] = float(ts)
+
+def peek_indicators(state, close=None, volume=None):
+    """
+    Returns (rsi, sma, avg_volume) as if a still-forming bar (close, volume) were appended,
+    without modifying `state`. With close=None only the committed bars are used.
+    SMA / average volume are NaN until their windows are full.
+    """
+    if close is None:
+        return (
+            _rsi(state["avg_gain"], state["avg_loss"]),
+            _window_mean(state["sma_sum"], state["sma_window"], SMA_PERIOD),
+            _window_mean(state["vol_sum"], state["vol_window"], VOL_PERIOD)
+        )
+
+    change = close - state["last_close"]
+    return (
+        _rsi(_wilder(state["avg_gain"], max(change, 0.0)), _wilder(state["avg_loss"], max(-change, 0.0))),
+        _window_mean(state["sma_sum"], state["sma_window"], SMA_PERIOD, close),
+        _window_mean(state["vol_sum"], state["vol_window"], VOL_PERIOD, volume)
+    )
+
+def state_to_doc(state):
+    """
+    Serializable form of `state` for MongoDB (running sums are rebuilt on load).
+    """
+    return {
+        "symbol": state["symbol"],
+        "last_close": state["last_close"],
+        "avg_gain": state["avg_gain"],
+        "avg_loss": state["avg_loss"],
+        "sma_window": list(state["sma_window"]),
+        "vol_window": list(state["vol_window"]),
+        "last_ts": state["last_ts"]
+    }
+
+def state_from_doc(doc):
+    sma_window = deque(doc["sma_window"], maxlen=SMA_PERIOD)
+    vol_window = deque(doc["vol_window"], maxlen=VOL_PERIOD)
+    return {
+        "symbol": doc["symbol"],
+        "last_close": doc["last_close"],
+        "avg_gain": doc["avg_gain"],
+        "avg_loss": doc["avg_loss"],
+        "sma_window": sma_window,
+        "sma_sum": sum(sma_window),
+        "vol_window": vol_window,
+        "vol_sum": sum(vol_window),
+        "last_ts": doc["last_ts"]
+    }
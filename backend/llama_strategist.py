@@ -1,13 +1,18 @@
 import os
 import json
 import time
+import asyncio
+import random
 import requests
 from datetime import datetime
 from dotenv import load_dotenv
 import pymongo
-from groq import Groq
+from groq import AsyncGroq
+from aiolimiter import AsyncLimiter
 import yfinance as yf
-from data_engine import ALL_MARKET_TICKERS, fetch_stock_data
+import numpy as np
+from data_engine import get_all_nse_tickers, fetch_stock_data, yf_session
+from indicators import seed_state, update_state, peek_indicators, matches_history, state_id, state_to_doc, state_from_doc
 
 # Load environment variables
 load_dotenv()
@@ -15,20 +20,25 @@ load_dotenv()
 # Configuration
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 MONGO_URI = os.getenv("MONGO_URI")
+GROQ_RPM = int(os.getenv("GROQ_RPM", "30")) # Requests per minute allowed by the Groq tier
+MAX_CONCURRENT_ANALYSES = 8
+HISTORY_1MO_BARS = 22 # Trading days in the 1-month history sent to the model
+STATE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60 # Older indicator state is re-seeded from full history
 
 # Initialize Clients
-client = Groq(api_key=GROQ_API_KEY)
+client = AsyncGroq(api_key=GROQ_API_KEY)
+groq_limiter = AsyncLimiter(GROQ_RPM, 60)
 
 # DB Connection
 mongo_client = None
 if MONGO_URI:
     try:
-        mongo_client = pymongo.MongoClient(MONGO_URI)
+        mongo_client = pymongo.AsyncMongoClient(MONGO_URI) # Async, so DB round trips overlap Groq/Yahoo I/O
         print("Connected to MongoDB.")
     except Exception as e:
         print(f"MongoDB Connection Failed: {e}")
 
-def fetch_portfolio(user_id="user_001"):
+async def fetch_portfolio(user_id="user_001"):
     """
     Fetches the user's current holdings and settings.
     """
@@ -37,7 +47,7 @@ def fetch_portfolio(user_id="user_001"):
     
     try:
         db = mongo_client["ai_hedge_fund"]
-        user = db["users"].find_one({"_id": user_id})
+        user = await db["users"].find_one({"_id": user_id})
         
         portfolio = {}
         if user and "portfolio" in user:
@@ -53,9 +63,58 @@ def fetch_portfolio(user_id="user_001"):
         print(f"Error fetching portfolio: {e}")
         return {}, {}
 
-def analyze_with_llama(stock_data, holding=None, user_settings=None):
+async def load_indicator_states(symbols, timeframe="1d"):
     """
-    Sends data to Llama 3 (via Groq) for analysis.
+    Loads saved incremental indicator state for `symbols` -> {symbol: state}.
+    """
+    if not mongo_client:
+        return {}
+    try:
+        col = mongo_client["ai_hedge_fund"]["indicator_state"]
+        docs = await col.find({"_id": {"$in": [state_id(s, timeframe) for s in symbols]}}).to_list(None)
+        return {d["symbol"]: state_from_doc(d) for d in docs}
+    except Exception as e:
+        print(f"Error loading indicator state: {e}")
+        return {}
+
+async def save_indicator_states(states, timeframe="1d"):
+    if not mongo_client or not states:
+        return
+    try:
+        col = mongo_client["ai_hedge_fund"]["indicator_state"]
+        ops = [
+            pymongo.UpdateOne({"_id": state_id(sym, timeframe)}, {"$set": state_to_doc(st)}, upsert=True)
+            for sym, st in states.items()
+        ]
+        await col.bulk_write(ops, ordered=False)
+    except Exception as e:
+        print(f"Error saving indicator state: {e}")
+
+def download_history(tickers, **kwargs):
+    """
+    Bulk-downloads daily bars for `tickers` in one threaded call -> {ticker: DataFrame}.
+    """
+    frames = {}
+    if not tickers:
+        return frames
+    try:
+        data = yf.download(tickers=tickers, group_by='ticker', threads=True,
+                           progress=False, auto_adjust=True, session=yf_session, **kwargs)
+    except Exception as e:
+        print(f"  > Bulk download failed: {e}")
+        return frames
+    for ticker in tickers:
+        try:
+            frames[ticker] = data[ticker].dropna()
+        except KeyError:
+            continue
+    return frames
+
+def build_system_prompt(user_settings=None):
+    """
+    Builds the static part of the analyst prompt once per run.
+    Only the per-ticker data goes in the user message, so the same system
+    prefix is shared (and prefix-cached) across every request in the batch.
     """
     
     # User Preferences Context
@@ -85,6 +144,39 @@ def analyze_with_llama(stock_data, holding=None, user_settings=None):
         - Avoid high volatility. Look for Blue Chips.
         """
 
+    return f"""
+    You are 'Llama 4 Maverick', the Chief Investment Officer. Output valid JSON only.
+    
+    **User Strategy Profile**:
+    - Risk Tolerance: {risk_profile}
+    - Time Horizon: {investment_period}
+    - **Target Return**: {expected_return}%
+    
+    {strategy_instruction}
+    
+    **Objective**: 
+    For the stock in the user message, provide a trading decision (BUY, SELL, WAIT) primarily based on the **User Strategy** above.
+    
+    **Output Format (JSON ONLY)**:
+    {{
+        "symbol": "<the analyzed symbol>",
+        "decision": "BUY" or "SELL" or "WAIT" or "AVOID",
+        "reasoning": "Brief explanation focused on the strategy (e.g., 'Matches aggressive growth target').",
+        "sentiment_score": "Positive/Negative/Neutral"
+    }}
+    """
+
+def _extract_json(text):
+    # Streamed replies are not constrained by JSON mode: drop code fences / stray prose
+    start, end = text.find("{"), text.rfind("}")
+    return text[start:end + 1] if start != -1 and end > start else text
+
+async def analyze_with_llama(stock_data, system_prompt, holding=None, on_first_token=None):
+    """
+    Sends data to Llama 3 (via Groq) for analysis.
+    The reply is streamed; `on_first_token` is called once generation has started.
+    """
+
     # Portfolio Context
     holding_context = ""
     if holding:
@@ -98,15 +190,6 @@ def analyze_with_llama(stock_data, holding=None, user_settings=None):
         holding_context = "**PORTFOLIO CONTEXT**: You do NOT own this stock."
 
     prompt = f"""
-    You are 'Llama 4 Maverick', the Chief Investment Officer.
-    
-    **User Strategy Profile**:
-    - Risk Tolerance: {risk_profile}
-    - Time Horizon: {investment_period}
-    - **Target Return**: {expected_return}%
-    
-    {strategy_instruction}
-    
     {holding_context}
     
     **Analyze {stock_data['fundamentals']['symbol']}**:
@@ -114,25 +197,14 @@ def analyze_with_llama(stock_data, holding=None, user_settings=None):
     2. **News**: {json.dumps(stock_data['news'])}
     3. **Price Data (Last 1 Month)**:
     {stock_data['history_1mo']}
-    
-    **Objective**: 
-    Provide a trading decision (BUY, SELL, WAIT) primarily based on the **User Strategy** above.
-    
-    **Output Format (JSON ONLY)**:
-    {{
-        "symbol": "{stock_data['fundamentals']['symbol']}",
-        "decision": "BUY" or "SELL" or "WAIT" or "AVOID",
-        "reasoning": "Brief explanation focused on the strategy (e.g., 'Matches aggressive growth target').",
-        "sentiment_score": "Positive/Negative/Neutral"
-    }}
     """
     
     try:
-        chat_completion = client.chat.completions.create(
+        stream = await client.chat.completions.create(
             messages=[
                 {
                     "role": "system",
-                    "content": "You are a financial analyst AI. Output valid JSON only."
+                    "content": system_prompt
                 },
                 {
                     "role": "user",
@@ -142,14 +214,60 @@ def analyze_with_llama(stock_data, holding=None, user_settings=None):
             model="llama-3.3-70b-versatile",
             temperature=0.3, # Increased slightly for creative strategy matching
             max_tokens=350,
-            response_format={"type": "json_object"} 
+            stream=True # JSON mode is not available with streaming; parsed below
         )
-        return chat_completion.choices[0].message.content
+        chunks = []
+        async for chunk in stream:
+            content = chunk.choices[0].delta.content if chunk.choices else None
+            if not content:
+                continue
+            if not chunks and on_first_token:
+                on_first_token()
+            chunks.append(content)
+        return _extract_json("".join(chunks))
     except Exception as e:
         print(f"   > Groq API Error: {e}")
         return None
 
-def save_to_mongodb(strategy_data):
+async def analyze_candidates(tickers, portfolio, settings, histories=None):
+    """
+    Phase 2: fetches data and asks Llama about every candidate concurrently,
+    bounded by a semaphore and the Groq rate limiter. A slot is freed as soon as
+    a reply starts streaming, so the next ticker's fetch overlaps the generation.
+    `histories` holds the Phase 1 3-month daily frames (cold tickers and holdings);
+    they are reused instead of downloading the 1-month history again.
+    Returns a list of analysis JSON strings (or None) in the order of `tickers`.
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_ANALYSES)
+    system_prompt = build_system_prompt(settings)
+
+    async def bounded(ticker):
+        await sem.acquire()
+        held = True
+
+        def release():
+            nonlocal held
+            if held:
+                held = False
+                sem.release()
+
+        try:
+            hist = (histories or {}).get(ticker)
+            if hist is not None and len(hist) >= HISTORY_1MO_BARS:
+                hist = hist.tail(HISTORY_1MO_BARS)
+            else:
+                hist = None # Too short (e.g. a recent listing): fetch the month as before
+            data = await asyncio.to_thread(fetch_stock_data, ticker, hist)
+            if not data:
+                return None
+            async with groq_limiter:
+                return await analyze_with_llama(data, system_prompt, portfolio.get(ticker), on_first_token=release)
+        finally:
+            release()
+
+    return await asyncio.gather(*(bounded(t) for t in tickers), return_exceptions=True)
+
+async def save_to_mongodb(strategy_data):
     if not mongo_client:
         return
 
@@ -157,115 +275,160 @@ def save_to_mongodb(strategy_data):
         db = mongo_client["ai_hedge_fund"]
         collection = db["daily_strategy"]
         query = {"date": strategy_data["date"]}
-        update = {"$set": strategy_data}
-        result = collection.update_one(query, update, upsert=True)
+        # Only the watchlist changes on a re-run; date/generated_at are written once on insert
+        update = {
+            "$set": {"watchlist": strategy_data["watchlist"]},
+            "$setOnInsert": {"date": strategy_data["date"], "generated_at": strategy_data["generated_at"]}
+        }
+        result = await collection.update_one(query, update, upsert=True)
         print(f"Strategy saved for {strategy_data['date']}.")
     except Exception as e:
         print(f"MongoDB Write Error: {e}")
 
-if __name__ == "__main__":
+async def main():
     print("--- Llama 4 Maverick: Market Strategist (Nifty 50) ---")
     
-    portfolio, settings = fetch_portfolio("user_001")
+    portfolio, settings = await fetch_portfolio("user_001")
     watchlist = []
     
     # --- MARKET SCREENING PHASE ---
+    ALL_MARKET_TICKERS = get_all_nse_tickers() # Cached list, only sampled (never mutated)
     print(f"\n[PHASE 1] Screening {len(ALL_MARKET_TICKERS)} stocks for high potential...")
     
     shortlisted_tickers = []
     
-    # 1. Technical Screen (Simulated fast scan)
-    # In a real app, we'd use a bulk downloader or database.
+    # 1. Technical Screen (fast scan on bulk-downloaded history)
     # Here we check Volume and Price change to filter "Active" stocks.
     
-    # Limit scan to save time, BUT shuffle first to avoid "Alphabetical Bias"
+    # Limit scan to save time, BUT sample randomly to avoid "Alphabetical Bias"
     # This ensures we get a random sample of the market every time.
-    import random
-    random.shuffle(ALL_MARKET_TICKERS)
-    
     scan_limit = 50 
     
     # --- CRITICAL: Always analyze current holdings for Exit Signals ---
     current_holdings = list(portfolio.keys())
     # Add holdings to the shortlist first
     shortlisted_tickers = current_holdings.copy()
+    shortlisted = set(shortlisted_tickers) # Holdings may also turn up in the scan
     print(f"  > Added {len(current_holdings)} portfolio stocks for Exit Analysis: {current_holdings}")
     
     print(f"  > Scanning Random {scan_limit} of {len(ALL_MARKET_TICKERS)} tickers (Advanced TA)...")
 
-    for ticker in ALL_MARKET_TICKERS[:scan_limit]:
-        try:
-            # Fetch 3 months for 50-day SMA
-            t = yf.Ticker(ticker)
-            hist = t.history(period="3mo")
-            
-            if len(hist) > 50:
-                # --- Advanced Technical Indicators ---
-                
-                # 1. RSI (14)
-                delta = hist['Close'].diff()
-                gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-                loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-                rs = gain / loss
-                rsi = 100 - (100 / (1 + rs)).iloc[-1]
-                
-                # 2. SMA (50) - Trend
-                sma_50 = hist['Close'].rolling(window=50).mean().iloc[-1]
-                current_price = hist['Close'].iloc[-1]
-                
-                # 3. Volume Spike (vs 20-day Avg)
-                avg_vol = hist['Volume'].rolling(window=20).mean().iloc[-1]
-                current_vol = hist['Volume'].iloc[-1]
-                vol_spike = current_vol > (1.5 * avg_vol)
-                
-                # --- Screening Criteria ---
-                reason = []
-                
-                # A. Portfolio Hold (Always Check)
-                if ticker in portfolio:
-                    reason.append("Existing Holding")
-                
-                # B. Oversold Dip (RSI < 30)
-                elif rsi < 30:
-                    reason.append(f"Oversold (RSI {rsi:.1f})")
-                    
-                # C. Momentum Breakout (Price > SMA50 AND Vol Spike)
-                elif current_price > sma_50 and vol_spike:
-                    reason.append(f"Momentum Breakout (Vol Spike, >SMA50)")
-                    
-                # D. Strong Uptrend (Price > SMA50 AND RSI 50-70)
-                elif current_price > sma_50 and 50 < rsi < 70:
-                    reason.append(f"Strong Uptrend (RSI {rsi:.1f})")
-                
-                if reason:
-                    shortlisted_tickers.append(ticker)
-                    print(f"  > Found Candidate: {ticker} | Matches: {', '.join(reason)}")
-                    
-        except Exception as e:
-            # print(f"Error screening {ticker}: {e}")
+    scan_tickers = random.sample(ALL_MARKET_TICKERS, min(scan_limit, len(ALL_MARKET_TICKERS)))
+
+    # Tickers with recent indicator state only need the bars since their last update;
+    # the rest (and holdings) get 3 months of history (for 50-day SMA) to seed from.
+    now = time.time()
+    states = {
+        t: st for t, st in (await load_indicator_states(scan_tickers)).items()
+        if now - st["last_ts"] < STATE_MAX_AGE_SECONDS
+    }
+    cold = [t for t in scan_tickers if t not in states]
+    full_history = await asyncio.to_thread(download_history, list(dict.fromkeys(cold + current_holdings)), period="3mo")
+    screen_data = dict(full_history) # Warm tickers get their short frames below; Phase 2 reuses only the 3-month ones
+    if states:
+        since = datetime.fromtimestamp(min(st["last_ts"] for st in states.values()))
+        screen_data.update(await asyncio.to_thread(download_history, list(states), start=since.strftime("%Y-%m-%d")))
+        # The fresh download still contains each state's last bar: if its adjusted close moved
+        # (split/dividend rescaling), the state mixes price scales and is re-seeded from 3 months
+        rescaled = [
+            t for t, st in states.items()
+            if t in screen_data and not matches_history(
+                st, [ts.timestamp() for ts in screen_data[t].index], screen_data[t]['Close'].to_numpy())
+        ]
+        if rescaled:
+            print(f"  > Re-seeding {len(rescaled)} tickers with rescaled history: {rescaled}")
+            for t in rescaled:
+                del states[t]
+                screen_data.pop(t)
+            reseed = await asyncio.to_thread(download_history, rescaled, period="3mo")
+            full_history.update(reseed)
+            screen_data.update(reseed)
+
+    # --- Advanced Technical Indicators (O(1) per new bar via incremental state) ---
+    panel_tickers, rsi_values, sma_values, prices, vols, avg_vols = [], [], [], [], [], []
+    for ticker in scan_tickers:
+        hist = screen_data.get(ticker)
+        if hist is None or hist.empty:
             continue
+        # The last bar may still be forming: only closed bars are folded into the state
+        closed = hist.iloc[:-1]
+        bar_ts = [ts.timestamp() for ts in hist.index]
+        state = states.get(ticker)
+        if state is None:
+            if len(hist) <= 50:
+                continue
+            state = seed_state(ticker, closed['Close'].to_numpy(), closed['Volume'].to_numpy(), bar_ts[-2])
+        else:
+            for ts, c, v in zip(bar_ts[:-1], closed['Close'].to_numpy(), closed['Volume'].to_numpy()):
+                if ts > state["last_ts"]:
+                    update_state(state, c, v, ts)
+        states[ticker] = state
+
+        if bar_ts[-1] > state["last_ts"]:
+            current_price, current_vol = float(hist['Close'].iloc[-1]), float(hist['Volume'].iloc[-1])
+            rsi, sma_50, avg_vol = peek_indicators(state, current_price, current_vol)
+        else:
+            current_price, current_vol = state["last_close"], state["vol_window"][-1]
+            rsi, sma_50, avg_vol = peek_indicators(state)
+
+        panel_tickers.append(ticker)
+        rsi_values.append(rsi)
+        sma_values.append(sma_50)
+        prices.append(current_price)
+        vols.append(current_vol)
+        avg_vols.append(avg_vol)
+
+    await save_indicator_states(states)
+
+    if panel_tickers:
+        rsi = np.array(rsi_values)                             # 1. RSI (14, Wilder)
+        sma_50 = np.array(sma_values)                          # 2. SMA (50) - Trend
+        current_price = np.array(prices)
+        vol_spike = np.array(vols) > 1.5 * np.array(avg_vols)  # 3. Volume Spike (vs 20-day Avg)
+
+        # --- Screening Criteria ---
+        in_portfolio = np.array([t in portfolio for t in panel_tickers])  # A. Portfolio Hold
+        oversold = rsi < 30                                               # B. Oversold Dip
+        above_sma = current_price > sma_50
+        breakout = above_sma & vol_spike                                  # C. Momentum Breakout
+        uptrend = above_sma & (rsi > 50) & (rsi < 70)                     # D. Strong Uptrend
+
+        for i in np.flatnonzero(in_portfolio | oversold | breakout | uptrend):
+            ticker = panel_tickers[i]
+            if in_portfolio[i]:
+                reason = "Existing Holding"
+            elif oversold[i]:
+                reason = f"Oversold (RSI {rsi[i]:.1f})"
+            elif breakout[i]:
+                reason = "Momentum Breakout (Vol Spike, >SMA50)"
+            else:
+                reason = f"Strong Uptrend (RSI {rsi[i]:.1f})"
+            if ticker not in shortlisted:
+                shortlisted.add(ticker)
+                shortlisted_tickers.append(ticker)
+            print(f"  > Found Candidate: {ticker} | Matches: {reason}")
             
     print(f"\n[PHASE 2] AI Deep Analysis on {len(shortlisted_tickers)} Candidates...")
     
-    for ticker in shortlisted_tickers:
+    results = await analyze_candidates(shortlisted_tickers, portfolio, settings, full_history)
+    
+    for ticker, analysis_json in zip(shortlisted_tickers, results):
         print(f"\nAnalyzing {ticker}...")
-        data = fetch_stock_data(ticker)
+        if isinstance(analysis_json, Exception):
+            print(f"  > Analysis Error: {analysis_json}")
+            continue
         
-        if data:
-            holding = portfolio.get(ticker)
-            analysis_json = analyze_with_llama(data, holding, settings)
-            
-            if analysis_json:
-                try:
-                    analysis = json.loads(analysis_json)
-                    print(f"  > Decision: {analysis['decision']} | {analysis['reasoning']}")
-                    if analysis['decision'] in ["BUY", "SELL"]:
-                        watchlist.append(analysis)
-                except:
-                    print("  > JSON Parse Error")
-            
-            # Groq Rate Limit handling
-            time.sleep(2) 
+        if analysis_json:
+            try:
+                analysis = json.loads(analysis_json)
+                analysis["symbol"] = ticker # The shared system prompt does not name the symbol
+                print(f"  > Decision: {analysis['decision']} | {analysis['reasoning']}")
+                if analysis['decision'] in ["BUY", "SELL"]:
+                    watchlist.append(analysis)
+            except:
+                print("  > JSON Parse Error")
+        else:
+            print("  > No data or no response.")
             
     # Save Strategy
     today_date = datetime.now().strftime('%Y-%m-%d')
@@ -275,5 +438,8 @@ if __name__ == "__main__":
         "generated_at": datetime.now().isoformat()
     }
     
-    save_to_mongodb(strategy)
+    await save_to_mongodb(strategy)
     print("\n--- Strategy Generation Complete ---")
+
+if __name__ == "__main__":
+    asyncio.run(main())
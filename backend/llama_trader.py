@@ -1,54 +1,87 @@
 import os
+import re
 import time
 import json
+import hashlib
+import asyncio
 import pymongo
 import yfinance as yf
-import pandas as pd
-import pandas_ta as ta
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq
+from data_engine import yf_session
+from indicators import seed_state, update_state, peek_indicators, matches_history, state_id, state_to_doc, state_from_doc
 
 # Load environment variables
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+NEWS_CACHE_TTL = timedelta(hours=2) # Reuse a verdict while the headlines stay the same
+RT_TIMEFRAME = "15m"
+MAX_CONCURRENT_SYMBOLS = 4
+NEWS_FETCH_WORKERS = 8
+
+# Investment period parsing ("6 Months", "2 Weeks", ...)
+_PERIOD_RE = re.compile(r"(\d+)")
+_MULT = {"Year": 365, "Month": 30, "Week": 7, "Day": 1}
 
 # Initialize Clients
-groq_client = Groq(api_key=GROQ_API_KEY)
-# client = pymongo.MongoClient(MONGO_URI)
-# db = client["ai_hedge_fund"]
+groq_client = AsyncGroq(api_key=GROQ_API_KEY)
+mongo_client = None # Async client shared (and pooled) by every task in the run
 
 def get_db_connection():
+    global mongo_client
     if not MONGO_URI:
         return None
     try:
-        client = pymongo.MongoClient(MONGO_URI)
-        return client["ai_hedge_fund"]
+        if mongo_client is None:
+            mongo_client = pymongo.AsyncMongoClient(MONGO_URI)
+        return mongo_client["ai_hedge_fund"]
     except Exception as e:
         print(f"DB Connection Error: {e}")
         return None
 
-def fetch_real_time_data(ticker_symbol):
+async def fetch_real_time_data(ticker_symbol, db=None):
     """
     Fetches real-time price and calculates RSI.
+    RSI (14, Wilder) is rolled forward from the saved 15m indicator state,
+    so only the last 2 days of bars are downloaded.
     """
     try:
-        ticker = yf.Ticker(ticker_symbol)
+        ticker = yf.Ticker(ticker_symbol, session=yf_session)
         
-        # We need recent history to calculate RSI (at least 14 periods)
-        # Fetching 5 days of 15m or 1h data
-        hist = ticker.history(period="5d", interval="15m")
+        # 14 periods at 15m = 3.5 hours; 2 days covers seeding and any gap since the last run
+        hist = await asyncio.to_thread(ticker.history, period="2d", interval=RT_TIMEFRAME)
         
-        if hist.empty:
+        if hist.empty or len(hist) < 16:
             return None
         
-        # Calculate RSI (14 period)
-        hist.ta.rsi(close='Close', length=14, append=True)
+        state_col = db["indicator_state"] if db is not None else None
+        state = None
+        if state_col is not None:
+            doc = await state_col.find_one({"_id": state_id(ticker_symbol, RT_TIMEFRAME)})
+            if doc:
+                state = state_from_doc(doc)
+        
+        # The last bar is still forming: only closed bars go into the state
+        bar_ts = [ts.timestamp() for ts in hist.index]
+        closes = hist['Close'].to_numpy()
+        volumes = hist['Volume'].to_numpy()
+        if state is None or not matches_history(state, bar_ts[:-1], closes[:-1]):
+            # No state, a gap wider than the fetched window, or rescaled (split-adjusted) prices: re-seed
+            state = seed_state(ticker_symbol, closes[:-1], volumes[:-1], bar_ts[-2])
+        else:
+            for ts, c, v in zip(bar_ts[:-1], closes[:-1], volumes[:-1]):
+                if ts > state["last_ts"]:
+                    update_state(state, c, v, ts)
         
-        current_price = hist['Close'].iloc[-1]
-        current_rsi = hist['RSI_14'].iloc[-1]
+        if state_col is not None:
+            await state_col.update_one({"_id": state_id(ticker_symbol, RT_TIMEFRAME)}, {"$set": state_to_doc(state)}, upsert=True)
+        
+        current_price = float(closes[-1])
+        current_rsi, _, _ = peek_indicators(state, current_price, float(volumes[-1]))
         
         return {
             "price": current_price,
@@ -59,14 +92,29 @@ def fetch_real_time_data(ticker_symbol):
         print(f"Error fetching RT data for {ticker_symbol}: {e}")
         return None
 
-def check_breaking_news(ticker_symbol):
+def fetch_news_batch(symbols):
+    """
+    Fetches yfinance news for all `symbols` concurrently -> {symbol: news list}.
     """
-    Fetches latest news and uses Llama 4 (Groq) to check for FATAL news.
+    def fetch(sym):
+        try:
+            return yf.Ticker(sym, session=yf_session).news or []
+        except Exception as e:
+            print(f"News Fetch Error for {sym}: {e}")
+            return []
+    
+    symbols = list(dict.fromkeys(symbols))
+    if not symbols:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(NEWS_FETCH_WORKERS, len(symbols))) as ex:
+        return dict(zip(symbols, ex.map(fetch, symbols)))
+
+async def check_breaking_news_from_items(ticker_symbol, news_list, db=None):
+    """
+    Classifies already fetched news items as FATAL or CLEAR with Llama 4 (Groq).
+    Verdicts are cached in `news_cache` by headline hash, so unchanged news skips the LLM call.
     """
     try:
-        ticker = yf.Ticker(ticker_symbol)
-        news_list = ticker.news
-        
         # Filter news from the last 2 hours (approx, using simple logic)
         # Note: yfinance news doesn't always have exact timestamp in easy format, 
         # but the list is sorted by recency. We'll take the top 3.
@@ -77,6 +125,14 @@ def check_breaking_news(ticker_symbol):
             
         news_text = "\n".join([f"- {n.get('title', 'No Title')}" for n in latest_news])
         
+        news_cache = db["news_cache"] if db is not None else None
+        cache_key = hashlib.sha256(f"{ticker_symbol}\n{news_text}".encode()).hexdigest()
+        now = datetime.now(timezone.utc)
+        if news_cache is not None:
+            cached = await news_cache.find_one({"_id": cache_key, "ts": {"$gt": now - NEWS_CACHE_TTL}}, {"verdict": 1})
+            if cached:
+                return cached["verdict"]
+        
         prompt = f"""
         You are a Risk Manager.
         
@@ -88,26 +144,34 @@ def check_breaking_news(ticker_symbol):
         Reply strictly with "FATAL" or "CLEAR".
         """
         
-        completion = groq_client.chat.completions.create(
+        completion = await groq_client.chat.completions.create(
             messages=[{"role": "user", "content": prompt}],
             model="llama-3.3-70b-versatile", # Upgraded to 70B "Maverick" level
         )
         
         decision = completion.choices[0].message.content.strip().upper()
-        return "FATAL" if "FATAL" in decision else "CLEAR"
+        verdict = "FATAL" if "FATAL" in decision else "CLEAR"
+        
+        if news_cache is not None:
+            await news_cache.update_one(
+                {"_id": cache_key},
+                {"$set": {"symbol": ticker_symbol, "verdict": verdict, "ts": now}},
+                upsert=True
+            )
+        return verdict
         
     except Exception as e:
         print(f"News Check Error: {e}")
         return "CLEAR" # Default to clear if check fails, or maybe "RISK"
 
-def execute_trade(db, user_id, symbol, action, price, qty, reason):
+async def execute_trade(db, user_id, symbol, action, price, qty, reason):
     """
     Executes a paper trade.
     """
     users_col = db["users"]
     logs_col = db["trade_logs"]
     
-    user = users_col.find_one({"_id": user_id})
+    user = await users_col.find_one({"_id": user_id})
     if not user:
         print("User not found.")
         return
@@ -116,19 +180,20 @@ def execute_trade(db, user_id, symbol, action, price, qty, reason):
     
     if action == "BUY":
         if user["balance"] >= cost:
-            # Deduct Balance
-            users_col.update_one({"_id": user_id}, {"$inc": {"balance": -cost}})
-            # Add to Holdings
-            users_col.update_one(
-                {"_id": user_id, "portfolio.symbol": symbol},
-                {"$inc": {"portfolio.$.qty": qty}},
-                upsert=False
-            )
-            # If not exists, push new
-            users_col.update_one(
-                {"_id": user_id, "portfolio.symbol": {"$ne": symbol}},
-                {"$push": {"portfolio": {"symbol": symbol, "qty": qty, "avg_price": price}}}
-            )
+            await users_col.bulk_write([
+                # Deduct Balance
+                pymongo.UpdateOne({"_id": user_id}, {"$inc": {"balance": -cost}}),
+                # Add to Holdings
+                pymongo.UpdateOne(
+                    {"_id": user_id, "portfolio.symbol": symbol},
+                    {"$inc": {"portfolio.$.qty": qty}}
+                ),
+                # If not exists, push new
+                pymongo.UpdateOne(
+                    {"_id": user_id, "portfolio.symbol": {"$ne": symbol}},
+                    {"$push": {"portfolio": {"symbol": symbol, "qty": qty, "avg_price": price}}}
+                )
+            ], ordered=True) # One round trip; order matters for the inc/push pair
             print(f"Executed BUY: {symbol} @ {price}")
         else:
             print(f"Insufficient funds for {symbol}")
@@ -138,17 +203,25 @@ def execute_trade(db, user_id, symbol, action, price, qty, reason):
         # Check holdings
         holding = next((p for p in user.get("portfolio", []) if p["symbol"] == symbol), None)
         if holding and holding["qty"] >= qty:
-            # Add Balance
-            users_col.update_one({"_id": user_id}, {"$inc": {"balance": cost}})
-            # Reduce Holdings
-            users_col.update_one(
-                {"_id": user_id, "portfolio.symbol": symbol},
-                {"$inc": {"portfolio.$.qty": -qty}}
-            )
-            # Remove if qty 0 (Optional, but cleaner)
-            users_col.update_one(
-                {"_id": user_id},
-                {"$pull": {"portfolio": {"symbol": symbol, "qty": {"$lte": 0}}}}
+            # Add Balance, reduce Holdings and drop it at qty 0, in one pipeline update
+            await users_col.update_one(
+                {"_id": user_id, "portfolio": {"$elemMatch": {"symbol": symbol, "qty": {"$gte": qty}}}},
+                [{"$set": {
+                    "balance": {"$add": ["$balance", cost]},
+                    "portfolio": {"$filter": {
+                        "input": {"$map": {
+                            "input": "$portfolio",
+                            "as": "p",
+                            "in": {"$cond": [
+                                {"$eq": ["$$p.symbol", symbol]},
+                                {"$mergeObjects": ["$$p", {"qty": {"$subtract": ["$$p.qty", qty]}}]},
+                                "$$p"
+                            ]}
+                        }},
+                        "as": "x",
+                        "cond": {"$gt": ["$$x.qty", 0]}
+                    }}
+                }}]
             )
             print(f"Executed SELL: {symbol} @ {price} (Profit/Loss realized)")
         else:
@@ -164,52 +237,152 @@ def execute_trade(db, user_id, symbol, action, price, qty, reason):
         "qty": qty,
         "ai_reason": reason
     }
-    logs_col.insert_one(log)
+    await logs_col.insert_one(log)
 
-if __name__ == "__main__":
+async def check_symbol(db, item, settings, sem, trade_lock):
+    """
+    Runs the price/RSI check for one watchlist item and executes SELL signals.
+    Returns (price, rsi) for a BUY that passes the RSI gate, otherwise None.
+    Trades are serialized by `trade_lock` so each one sees the balance left by the previous trade.
+    """
+    symbol = item["symbol"]
+    gemini_reason = item["reasoning"]
+    
+    async with sem:
+        # Real-time Data
+        rt_data = await fetch_real_time_data(symbol, db)
+    if not rt_data:
+        print(f"\n[{symbol}] No data.")
+        return None
+        
+    rsi = rt_data["rsi"]
+    price = rt_data["price"]
+    print(f"\n[{symbol}] Price: {price}, RSI: {rsi:.2f}")
+    
+    # Logic: Buy if Gemini said BUY AND RSI is favorable
+    # Logic: Sell if Gemini said SELL
+    
+    decision = item.get("decision", "BUY") 
+    
+    if decision == "SELL":
+        print(f"[{symbol}] >>> LLAMA SIGNAL: SELL ({gemini_reason})")
+        # Execute SELL immediately (or check RSI for 'overbought' confirmation if desired)
+        qty = 5 # Default sell qty, should be dynamic
+        async with trade_lock:
+            await execute_trade(db, "user_001", symbol, "SELL", price, qty, f"Llama Take Profit: {gemini_reason[:20]}...")
+
+    elif decision == "BUY":
+        # Dynamic RSI Threshold based on User Risk
+        rsi_limit = 40 # Default Conservative
+        if settings.get("risk_profile") == "Aggressive":
+            rsi_limit = 70 # Buy momentum
+        elif settings.get("risk_profile") == "Balanced":
+            rsi_limit = 55
+        
+        # Check RSI
+        if rsi < rsi_limit: 
+            print(f"[{symbol}] Technical Setup VALID (RSI {rsi:.1f} < {rsi_limit}).")
+            return price, rsi
+        print(f"[{symbol}] RSI too high ({rsi:.1f} >= {rsi_limit}). Waiting for dip.")
+    return None
+
+async def buy_symbol(db, item, price, rsi, news_list, sem, trade_lock):
+    """
+    Runs the news check for a BUY that passed the RSI gate and executes it if CLEAR.
+    """
+    symbol = item["symbol"]
+    gemini_reason = item["reasoning"]
+    
+    # News Check
+    async with sem:
+        news_status = await check_breaking_news_from_items(symbol, news_list, db)
+    print(f"[{symbol}] News Status: {news_status}")
+    
+    if news_status != "CLEAR":
+        print(f"[{symbol}] Trade BLOCKED by negative news.")
+        return
+    print(f"[{symbol}] >>> TRIGGERING BUY!")
+    
+    async with trade_lock:
+        # Dynamic Quantity Calculation
+        # Read the balance under the lock: other symbols may have just traded
+        user = await db["users"].find_one({"_id": "user_001"}, {"balance": 1})
+        user_balance = user.get("balance", 0) if user else 0
+        allocatable_amount = user_balance * 0.95 # Keep 5% buffer
+        
+        target_investment = allocatable_amount / 3 # Target 3 stocks approx
+        if target_investment < price:
+             target_investment = allocatable_amount # Try to buy at least one using full balance if needed
+        
+        qty = int(target_investment // price)
+        
+        if qty > 0:
+            await execute_trade(db, "user_001", symbol, "BUY", price, qty, f"Llama: {gemini_reason[:20]}... | RSI: {rsi:.1f}")
+        else:
+            print(f"[{symbol}] Insufficient balance to buy 1 share (Price: {price}, Bal: {user_balance})")
+
+def _report_errors(items, results):
+    for item, result in zip(items, results):
+        if isinstance(result, Exception):
+            print(f"[{item['symbol']}] Error: {result}")
+
+async def trade_watchlist(db, watchlist, settings):
+    """
+    Checks every watchlist symbol concurrently, then pulls news in one batch
+    only for the BUYs that passed the RSI gate and trades those.
+    """
+    sem = asyncio.Semaphore(MAX_CONCURRENT_SYMBOLS)
+    trade_lock = asyncio.Lock()
+    results = await asyncio.gather(
+        *(check_symbol(db, item, settings, sem, trade_lock) for item in watchlist),
+        return_exceptions=True
+    )
+    _report_errors(watchlist, results)
+    
+    candidates = [(item, result) for item, result in zip(watchlist, results) if isinstance(result, tuple)]
+    if not candidates:
+        return
+    news_by_symbol = await asyncio.to_thread(fetch_news_batch, [item["symbol"] for item, _ in candidates])
+    results = await asyncio.gather(
+        *(buy_symbol(db, item, price, rsi, news_by_symbol.get(item["symbol"], []), sem, trade_lock)
+          for item, (price, rsi) in candidates),
+        return_exceptions=True
+    )
+    _report_errors([item for item, _ in candidates], results)
+
+async def main():
     print("--- Llama 4 Maverick: Context-Aware Trader ---")
     
     db = get_db_connection()
     if db is None:
         print("No DB Connection. Exiting.")
-        exit()
+        return
         
     # 1. Load Daily Strategy
     today_str = datetime.now().strftime("%Y-%m-%d")
-    strategy = db["daily_strategy"].find_one({"date": today_str})
+    strategy = await db["daily_strategy"].find_one({"date": today_str})
     
     # --- CHECK INVESTMENT PERIOD ---
-    user = db["users"].find_one({"_id": "user_001"})
+    user = await db["users"].find_one({"_id": "user_001"})
     settings = user.get("settings", {})
     start_date_str = settings.get("start_date")
-    period_str = settings.get("investment_period", "1 Month")
+    period_str = str(settings.get("investment_period") or "1 Month") # Stored as sent by the client: may be null
     
     if start_date_str:
         start_date = datetime.fromisoformat(start_date_str)
         
         # Robust parser for "X Unit(s)" (e.g., "6 Months", "2 Weeks")
-        try:
-            import re
-            match = re.search(r"(\d+)", period_str)
-            qty = int(match.group(1)) if match else 1
-            
-            multiplier = 1 # Default to Days
-            if "Year" in period_str: multiplier = 365
-            elif "Month" in period_str: multiplier = 30
-            elif "Week" in period_str: multiplier = 7
-            
-            days_limit = qty * multiplier
-            
-        except Exception as e:
-            print(f"Error parsing period '{period_str}': {e}")
-            days_limit = 30 # Default safety
+        match = _PERIOD_RE.search(period_str)
+        qty = int(match.group(1)) if match else 1
+        multiplier = next((v for k, v in _MULT.items() if k in period_str), 1) # Default to Days
+        days_limit = qty * multiplier
         
         elapsed = datetime.now() - start_date
         if elapsed.days >= days_limit:
             print(f"!!! INVESTMENT PERIOD ENDED ({period_str} | {days_limit} days) !!!")
             print(f"Elapsed: {elapsed.days} days. Trading HALTED.")
             print("Please reset your settings or start a new period to continue.")
-            exit()
+            return
         else:
             print(f"Investment Day: {elapsed.days + 1}/{days_limit} ({period_str})")
 
@@ -217,82 +390,15 @@ if __name__ == "__main__":
         print(f"No strategy found for {today_str}. Run llama_strategist.py first.")
         # Fallback or exit
         # for demo purposes, let's assume we have a watchlist or exit
-        exit()
+        return
         
     watchlist = strategy.get("watchlist", [])
     print(f"Loaded Watchlist: {[item['symbol'] for item in watchlist]}")
     
-    # 2. Iterate and Trade
-    for item in watchlist:
-        symbol = item["symbol"]
-        gemini_reason = item["reasoning"]
-        
-        print(f"\nChecking {symbol}...")
-        
-        # Real-time Data
-        rt_data = fetch_real_time_data(symbol)
-        if not rt_data:
-            print("  > No data.")
-            continue
-            
-        rsi = rt_data["rsi"]
-        price = rt_data["price"]
-        print(f"  > Price: {price}, RSI: {rsi:.2f}")
-        
-        # Logic: Buy if Gemini said BUY AND RSI is favorable
-        # Logic: Sell if Gemini said SELL
-        
-        decision = item.get("decision", "BUY") 
-        
-        if decision == "SELL":
-             print(f"  >>> LLAMA SIGNAL: SELL ({gemini_reason})")
-             # Execute SELL immediately (or check RSI for 'overbought' confirmation if desired)
-             qty = 5 # Default sell qty, should be dynamic
-             execute_trade(db, "user_001", symbol, "SELL", price, qty, f"Llama Take Profit: {gemini_reason[:20]}...")
-
-        elif decision == "BUY":
-            # Dynamic RSI Threshold based on User Risk
-            rsi_limit = 40 # Default Conservative
-            if settings.get("risk_profile") == "Aggressive":
-                rsi_limit = 70 # Buy momentum
-            elif settings.get("risk_profile") == "Balanced":
-                rsi_limit = 55
-            
-            # Check RSI
-            if rsi < rsi_limit: 
-                print(f"  > Technical Setup VALID (RSI {rsi:.1f} < {rsi_limit}).")
-                
-                # News Check
-                news_status = check_breaking_news(symbol)
-                print(f"  > News Status: {news_status}")
-                
-                if news_status == "CLEAR":
-                    print("  >>> TRIGGERING BUY!")
-                    
-                    # Dynamic Quantity Calculation
-                    # Invest up to 20% of balance per trade, or at least 1 share
-                    # But if balance is small (like 1000), maybe invest 50% or 100% for testing?
-                    # Let's use 25% of *remaining* balance per trade to diversify slightly
-                    
-                    user_balance = user.get("balance", 0)
-                    allocatable_amount = user_balance * 0.95 # Keep 5% buffer
-                    
-                    # If this is the only trade, we might want to use more.
-                    # For now, let's max out at 1 share minimum.
-                    
-                    target_investment = allocatable_amount / 3 # Target 3 stocks approx
-                    if target_investment < price:
-                         target_investment = allocatable_amount # Try to buy at least one using full balance if needed
-                    
-                    qty = int(target_investment // price)
-                    
-                    if qty > 0:
-                        execute_trade(db, "user_001", symbol, "BUY", price, qty, f"Llama: {gemini_reason[:20]}... | RSI: {rsi:.1f}")
-                    else:
-                        print(f"  > Insufficient balance to buy 1 share (Price: {price}, Bal: {user_balance})")
-                else:
-                    print("  > Trade BLOCKED by negative news.")
-            else:
-                print(f"  > RSI too high ({rsi:.1f} >= {rsi_limit}). Waiting for dip.")
+    # 2. Trade every watchlist symbol concurrently
+    await trade_watchlist(db, watchlist, settings)
     
     print("\nTrading cycle complete.")
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -5,6 +5,21 @@ from dotenv import load_dotenv
 load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 
+def create_indexes(db):
+    """
+    Indexes for the lookups the trader, strategist and API run on every cycle.
+    create_index is idempotent, so this is safe to re-run.
+    """
+    # Trader / strategist: find_one and upsert by date
+    db["daily_strategy"].create_index([("date", 1)], unique=True)
+    # API: latest trades first (sort on timestamp), optionally per symbol
+    db["trade_logs"].create_index([("timestamp", -1), ("symbol", 1)])
+    # Trader: breaking-news verdicts expire after 2 hours
+    db["news_cache"].create_index([("ts", 1)], expireAfterSeconds=7200)
+    # Gemini brain: cached fundamentals expire after a day
+    db["fundamentals_cache"].create_index([("ts", 1)], expireAfterSeconds=24 * 60 * 60)
+    print("Indexes ensured.")
+
 def init_db():
     if not MONGO_URI:
         print("MONGO_URI not set.")
@@ -28,6 +43,8 @@ def init_db():
             }
             users_col.insert_one(user_data)
             print("User 'user_001' created with 1000 INR capital.")
+        
+        create_indexes(db)
             
     except Exception as e:
         print(f"Error: {e}")
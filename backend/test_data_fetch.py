@@ -1,8 +1,9 @@
 import yfinance as yf
+from data_engine import yf_session
 
 def test_fetch(ticker_symbol):
     print(f"--- Testing {ticker_symbol} ---")
-    ticker = yf.Ticker(ticker_symbol)
+    ticker = yf.Ticker(ticker_symbol, session=yf_session)
     
     # 1. History
     try:
@@ -11,13 +12,13 @@ def test_fetch(ticker_symbol):
     except Exception as e:
         print(f"History Error: {e}")
 
-    # 2. Info keys
+    # 2. Fast info (avoids the full `info` scrape)
     try:
-        info = ticker.info
-        print(f"Info Keys: {list(info.keys())[:5]}") # Print first 5 keys
-        print(f"Current Price: {info.get('currentPrice')}")
+        fi = ticker.fast_info
+        print(f"Fast Info Keys: {list(fi.keys())[:5]}") # Print first 5 keys
+        print(f"Current Price: {fi['lastPrice']}")
     except Exception as e:
-        print(f"Info Error: {e}")
+        print(f"Fast Info Error: {e}")
 
 if __name__ == "__main__":
     test_fetch("AAPL") 